@@ -1,12 +1,16 @@
+import asyncio
+import atexit
+import hashlib
+import io
 import logging
 import os
-import requests
+from PIL import Image
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
-from doctr.io import DocumentFile
-from doctr.models import ocr_predictor
 from dotenv import load_dotenv
 
+from telebirr import BANK_NAME, LRUCache, VerificationError, client, process_image_for_txid, verify, warm_up
+
 # --- UPDATED LOGGING CONFIGURATION ---
 # Create a logger
 logger = logging.getLogger(__name__)
@@ -29,123 +33,109 @@ logger.addHandler(handler)
 
 load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-
-model = ocr_predictor(det_arch='db_resnet50', reco_arch='crnn_vgg16_bn', pretrained=True)
+# When set (e.g. http://localhost:8001), OCR is delegated to the standalone
+# inference service in ocr_service.py instead of running in this process
+OCR_SERVICE_URL = os.getenv("OCR_SERVICE_URL")
+
+os.makedirs('downloads', exist_ok=True)
+
+# SHA-256 of the downloaded JPEG -> (bank_name, tx_id, verify_url), so a
+# re-forwarded receipt skips the OCR pass entirely. Persisted across runs.
+_OCR_CACHE_PATH = 'downloads/.ocr_cache.pkl'
+_ocr_cache = LRUCache(maxsize=1024)
+if os.path.exists(_OCR_CACHE_PATH):
+    _ocr_cache.load(_OCR_CACHE_PATH)
+atexit.register(lambda: _ocr_cache.save(_OCR_CACHE_PATH))
+
+# Receipts are legible to the detector well below phone-camera resolution,
+# and docTR's cost scales with pixel count
+_MAX_OCR_SIDE = 1280
+
+def _downsample_receipt(image_bytes: bytes) -> bytes:
+    """
+    Caps the image's long side at _MAX_OCR_SIDE px, re-encoding in memory.
+    Returns the original bytes for images that are already small enough.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            if max(image.size) <= _MAX_OCR_SIDE:
+                return image_bytes
+            image.thumbnail((_MAX_OCR_SIDE, _MAX_OCR_SIDE), Image.Resampling.BILINEAR)
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=88)
+            return buffer.getvalue()
+    except Exception as e:
+        logger.warning(f"Could not downsample receipt, using original: {e}")
+        return image_bytes
+
+async def _ocr_receipt(image_bytes: bytes):
+    """
+    Runs OCR remotely when OCR_SERVICE_URL is set, in-process otherwise.
+    """
+    if OCR_SERVICE_URL:
+        response = await client.post(f"{OCR_SERVICE_URL}/ocr", content=image_bytes)
+        response.raise_for_status()
+        payload = response.json()
+        return payload['tx_id'], payload['verify_url']
+    return await process_image_for_txid(image_bytes)
 
 async def start(update: Update, context) -> None:
     await update.message.reply_text('Hello! Send me a picture of a Telebirr receipt and I will check it for you.')
 
-def extract_transaction_info(text_data):
-    label = "Transaction Number"
-    verify_url = "https://transactioninfo.ethiotelecom.et/receipt/{}"
-    bank_name = "Telebirr"
-    
-    text_data_lower = text_data.lower()
-    
-    if label.lower() in text_data_lower:
-        try:
-            start_index = text_data_lower.find(label.lower())
-            end_of_label = start_index + len(label)
-            remainder = text_data[end_of_label:].strip().replace(':', '')
-            
-            if remainder:
-                tx_id = remainder.split()[0].upper()
-                return bank_name, tx_id, verify_url
-        except (IndexError, ValueError) as e:
-            logger.warning(f"Error extracting transaction ID: {e}")
-            
-    return None, None, None
-
-async def process_image_for_txid(image_path: str):
-    try:
-        logger.info(f"Starting docTR OCR on image: {image_path}")
-        doc = DocumentFile.from_images([image_path])
-        result = model(doc)
-        
-        if not result or not result.pages:
-            logger.warning("docTR did not return any pages. OCR likely failed.")
-            return None, None, None
-            
-        full_text = ""
-        for page in result.pages:
-            for block in page.blocks:
-                for line in block.lines:
-                    full_text += " ".join([word.value for word in line.words]) + "\n"
-        
-        if not full_text.strip():
-            logger.warning("docTR extracted empty text. OCR likely failed to detect anything.")
-            return None, None, None
-
-        logger.info(f"Extracted text using docTR: \n{full_text}")
-
-        bank_name, tx_id, verify_url = extract_transaction_info(full_text)
-        
-        return bank_name, tx_id, verify_url
-        
-    except Exception as e:
-        logger.error(f"Error processing image {image_path} with docTR: {e}", exc_info=True)
-        return None, None, None
+def _pick_photo_size(photo_sizes):
+    """
+    Picks the smallest Telegram-provided variant that is still wide enough
+    for OCR, instead of always downloading the multi-MB original.
+    """
+    return min(
+        (p for p in photo_sizes if p.width >= 1024),
+        key=lambda p: p.width,
+        default=photo_sizes[-1],
+    )
 
 async def handle_photo(update: Update, context) -> None:
-    file_path = None
     try:
-        photo_file = await update.message.photo[-1].get_file()
-        file_path = f'downloads/{photo_file.file_id}.jpg'
-        os.makedirs('downloads', exist_ok=True)
-        await photo_file.download_to_drive(file_path)
+        photo_file = await _pick_photo_size(update.message.photo).get_file()
+        image_bytes = bytes(await photo_file.download_as_bytearray())
+        image_bytes = await asyncio.to_thread(_downsample_receipt, image_bytes)
 
         await update.message.reply_text("Processing your receipt...")
         
-        bank_name, tx_id, verify_url = await process_image_for_txid(file_path)
+        image_hash = hashlib.sha256(image_bytes).digest()
+        
+        cached = _ocr_cache.get(image_hash)
+        if cached is not None:
+            logger.info("OCR cache hit; skipping docTR for this image")
+            bank_name, tx_id, verify_url = cached
+        else:
+            tx_id, verify_url = await _ocr_receipt(image_bytes)
+            bank_name = BANK_NAME
+            if tx_id and verify_url:
+                _ocr_cache.put(image_hash, (bank_name, tx_id, verify_url))
         
         if tx_id and verify_url:
-            full_url = verify_url.format(tx_id)
-            
             try:
-                response = requests.get(full_url, timeout=10)
-                success_string = "የቴሌብር ክፍያ መረጃ/telebirr Transaction information"
-                
-                if response.status_code == 200 and success_string in response.text:
+                verified_tx_id = await verify(tx_id, verify_url)
+            except VerificationError as e:
+                logger.error(f"Error during receipt verification: {e}")
+                await update.message.reply_text("An error occurred while trying to verify the receipt. Please try again later.")
+                return
+            
+            if verified_tx_id:
+                full_url = verify_url.format(verified_tx_id)
+                if verified_tx_id == tx_id:
                     await update.message.reply_text("✅ Congratulations! The receipt is valid. 🎉")
-                    await update.message.reply_text(f"You can view the full receipt here: {full_url}")
                 else:
-                    if 'O' in tx_id:
-                        normalized_tx_id = tx_id.replace('O', '0')
-                        normalized_url = verify_url.format(normalized_tx_id)
-                        normalized_response = requests.get(normalized_url, timeout=10)
-                        if normalized_response.status_code == 200 and success_string in normalized_response.text:
-                            await update.message.reply_text("✅ Congratulations! The receipt is valid after correcting an OCR error (O to 0). 🎉")
-                            await update.message.reply_text(f"You can view the full receipt here: {normalized_url}")
-                            if os.path.exists(file_path):
-                                os.remove(file_path)
-                            return
-                            
-                    if '0' in tx_id:
-                        normalized_tx_id = tx_id.replace('0', 'O')
-                        normalized_url = verify_url.format(normalized_tx_id)
-                        normalized_response = requests.get(normalized_url, timeout=10)
-                        if normalized_response.status_code == 200 and success_string in normalized_response.text:
-                            await update.message.reply_text("✅ Congratulations! The receipt is valid after correcting an OCR error (0 to O). 🎉")
-                            await update.message.reply_text(f"You can view the full receipt here: {normalized_url}")
-                            if os.path.exists(file_path):
-                                os.remove(file_path)
-                            return
-                            
-                    await update.message.reply_text("❌ The receipt could not be verified. It appears to be invalid or there was an OCR error.")
-            
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Error during HTTP request: {e}")
-                await update.message.reply_text("An error occurred while trying to verify the receipt. Please try again later.")
+                    await update.message.reply_text("✅ Congratulations! The receipt is valid after correcting an OCR error (O/0). 🎉")
+                await update.message.reply_text(f"You can view the full receipt here: {full_url}")
+            else:
+                await update.message.reply_text("❌ The receipt could not be verified. It appears to be invalid or there was an OCR error.")
         else:
             await update.message.reply_text("Could not find a valid transaction ID in the receipt. Please try again with a clearer image.")
             
     except Exception as e:
         logger.error(f"Error during image processing: {e}", exc_info=True)
         await update.message.reply_text("An internal error occurred. Please try again with a different image.")
-        
-    finally:
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
 
 async def handle_document(update: Update, context) -> None:
     await update.message.reply_text("This bot only processes images for Telebirr receipts.")
@@ -156,6 +146,12 @@ def main() -> None:
     application.add_handler(MessageHandler(filters.PHOTO & ~filters.COMMAND, handle_photo))
     application.add_handler(MessageHandler(filters.Document.PDF & ~filters.COMMAND, handle_document))
     
+    # Hide first-inference latency from the first user; the standalone
+    # OCR service warms its own model up
+    if not OCR_SERVICE_URL:
+        logger.info("Warming up the OCR model...")
+        warm_up()
+    
     # This line will now log to your terminal
     logger.info("Application started. Listening for updates...")
     
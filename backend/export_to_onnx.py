@@ -0,0 +1,90 @@
+"""
+One-time export of the docTR detector/recognizer to ONNX.
+
+Writes db_resnet50.onnx and crnn_vgg16_bn.onnx (with a dynamic batch
+dimension) into backend/models/, where onnx_ocr.py picks them up when the
+bot runs with OCR_BACKEND=onnx. The recognizer is additionally
+dynamically quantized to INT8 (crnn_vgg16_bn_int8.onnx); pass
+--calibration-dir with ~50 sample receipt images to also produce a
+statically quantized detector (db_resnet50_int8.onnx). The quantized
+models are used when the bot runs with OCR_PRECISION=int8.
+"""
+import argparse
+import glob
+import os
+
+import torch
+from doctr.models import ocr_predictor
+from doctr.models.utils import export_model_to_onnx
+from onnxruntime.quantization import CalibrationDataReader, QuantType, quantize_dynamic, quantize_static
+
+from onnx_ocr import _DET_MEAN, _DET_SIZE, _DET_STD, _normalize
+
+
+class _ReceiptCalibrationReader(CalibrationDataReader):
+    """Feeds detector-normalized sample receipts to the static quantizer."""
+
+    def __init__(self, image_dir, input_name):
+        import cv2
+        paths = sorted(glob.glob(os.path.join(image_dir, '*.jpg')) + glob.glob(os.path.join(image_dir, '*.png')))
+        self._batches = iter(
+            {input_name: _normalize(cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB), _DET_SIZE, _DET_MEAN, _DET_STD)}
+            for path in paths
+        )
+
+    def get_next(self):
+        return next(self._batches, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--output-dir', default=os.path.join(os.path.dirname(__file__), 'models'))
+    parser.add_argument('--calibration-dir', default=None,
+                        help='Directory of sample receipt images for static INT8 detector quantization')
+    args = parser.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    predictor = ocr_predictor(det_arch='db_resnet50', reco_arch='crnn_vgg16_bn', pretrained=True)
+
+    det_model = predictor.det_predictor.model.eval()
+    reco_model = predictor.reco_predictor.model.eval()
+
+    # In exportable mode the models return raw logits instead of running
+    # their numpy/string postprocessors, which torch.onnx.export cannot
+    # trace (and onnx_ocr applies its own sigmoid/CTC decode anyway)
+    det_model.exportable = True
+    reco_model.exportable = True
+
+    det_path = export_model_to_onnx(
+        det_model,
+        model_name=os.path.join(args.output_dir, 'db_resnet50'),
+        dummy_input=torch.rand((1, 3, 1024, 1024), dtype=torch.float32),
+    )
+    print(f"Exported detector to {det_path}")
+
+    reco_path = export_model_to_onnx(
+        reco_model,
+        model_name=os.path.join(args.output_dir, 'crnn_vgg16_bn'),
+        dummy_input=torch.rand((1, 3, 32, 128), dtype=torch.float32),
+    )
+    print(f"Exported recognizer to {reco_path}")
+
+    # Dynamic INT8 quantization is accurate enough for the CRNN's GEMM-heavy
+    # stack and needs no calibration data
+    reco_int8_path = reco_path.replace('.onnx', '_int8.onnx')
+    quantize_dynamic(reco_path, reco_int8_path, weight_type=QuantType.QInt8)
+    print(f"Quantized recognizer to {reco_int8_path}")
+
+    # The conv-only detector needs static quantization with real activations
+    if args.calibration_dir:
+        import onnxruntime as ort
+        input_name = ort.InferenceSession(det_path).get_inputs()[0].name
+        det_int8_path = det_path.replace('.onnx', '_int8.onnx')
+        quantize_static(det_path, det_int8_path, _ReceiptCalibrationReader(args.calibration_dir, input_name))
+        print(f"Quantized detector to {det_int8_path}")
+    else:
+        print("No --calibration-dir given; skipping static detector quantization")
+
+
+if __name__ == "__main__":
+    main()
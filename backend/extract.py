@@ -0,0 +1,70 @@
+"""
+Shared transaction-ID extraction for the receipt pipeline.
+
+Kept in its own module so every consumer uses one implementation, and
+memoized so re-submitted receipt text is only parsed once. When numba is
+installed, the label search runs as a JIT-compiled, GIL-free byte scan
+(useful on CPU-only deployments where OCR already saturates the cores);
+otherwise the compiled regex alone does the work.
+"""
+import logging
+import re
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    from numba import njit
+    _HAVE_NUMBA = True
+except ImportError:
+    _HAVE_NUMBA = False
+
+# Matches the "Transaction Number" label and the ID that follows it in one
+# C-level pass, replacing the lower()/find()/split() scans and their
+# full-text copies
+_TX_RE = re.compile(r'transaction\s*number[:\s]*([A-Z0-9]+)', re.IGNORECASE)
+
+if _HAVE_NUMBA:
+    # ASCII lowercase lookup table; non-ASCII UTF-8 bytes pass through
+    # untouched, which is fine since the label itself is pure ASCII
+    _LOWER_TABLE = np.arange(256, dtype=np.uint8)
+    _LOWER_TABLE[65:91] += 32
+    _LABEL_BYTES = np.frombuffer(b'transaction number', dtype=np.uint8)
+
+    @njit(cache=True, nogil=True)
+    def _find_label(data, lower_table, label):
+        """Case-insensitive linear scan; returns the label offset or -1."""
+        for i in range(data.size - label.size + 1):
+            hit = True
+            for j in range(label.size):
+                if lower_table[data[i + j]] != label[j]:
+                    hit = False
+                    break
+            if hit:
+                return i
+        return -1
+
+
+@lru_cache(maxsize=2048)
+def extract_transaction_info(text_data):
+    """
+    Parses the text data to find "Transaction Number" and extracts the value that follows.
+    """
+    if _HAVE_NUMBA:
+        data = np.frombuffer(text_data.encode('utf-8'), dtype=np.uint8)
+        start = _find_label(data, _LOWER_TABLE, _LABEL_BYTES)
+        if start >= 0:
+            # Decode only a short tail around the label; the regex still does
+            # the final tokenization of the ID
+            tail = data[start:start + 80].tobytes().decode('utf-8', 'ignore')
+            match = _TX_RE.search(tail)
+            if match:
+                return match.group(1).upper()
+        # Fall through to the regex: the label may be split by unusual
+        # whitespace the fixed byte pattern does not cover
+
+    match = _TX_RE.search(text_data)
+    if match:
+        return match.group(1).upper()
+    return None
@@ -0,0 +1,41 @@
+"""
+Standalone OCR inference service.
+
+Keeps the OCR model (and telebirr's micro-batching queue) resident in a
+dedicated process, so the Telegram frontend stays small and inference
+workers can be scaled or moved to a GPU node independently. Run with:
+
+    uvicorn ocr_service:app --host 0.0.0.0 --port 8001
+
+and point the bot at it with OCR_SERVICE_URL=http://localhost:8001.
+"""
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+
+from telebirr import process_image_for_txid, warm_up
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    logger.info("Warming up the OCR model...")
+    warm_up()
+    yield
+
+
+app = FastAPI(title="AI receipt checker OCR service", lifespan=_lifespan)
+
+
+@app.post("/ocr")
+async def ocr(request: Request):
+    """
+    Accepts raw JPEG bytes and returns the extracted transaction info.
+    Requests from concurrent bot workers share the batching queue, so
+    inference is continuously batched across clients.
+    """
+    image_bytes = await request.body()
+    tx_id, verify_url = await process_image_for_txid(image_bytes)
+    return {"tx_id": tx_id, "verify_url": verify_url}
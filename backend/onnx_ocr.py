@@ -0,0 +1,172 @@
+"""
+ONNX-Runtime backend for the receipt OCR pipeline.
+
+Loads the detector/recognizer exported by export_to_onnx.py through
+onnxruntime with whatever execution provider is available (CUDA, OpenVINO,
+CPU, ...) and mimics the small slice of docTR's page/block/line/word output
+structure that process_image_for_txid consumes. Enabled via OCR_BACKEND=onnx.
+"""
+import logging
+import os
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import onnxruntime as ort
+from doctr.datasets import VOCABS
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), 'models')
+DET_ONNX_PATH = os.path.join(MODEL_DIR, 'db_resnet50.onnx')
+RECO_ONNX_PATH = os.path.join(MODEL_DIR, 'crnn_vgg16_bn.onnx')
+
+# Input geometries and normalization constants matching the docTR defaults
+_DET_SIZE = (1024, 1024)
+_DET_MEAN = np.array([0.798, 0.785, 0.772], dtype=np.float32)
+_DET_STD = np.array([0.264, 0.2749, 0.287], dtype=np.float32)
+_RECO_SIZE = (32, 128)
+_RECO_MEAN = np.array([0.694, 0.695, 0.693], dtype=np.float32)
+_RECO_STD = np.array([0.299, 0.296, 0.301], dtype=np.float32)
+
+_BIN_THRESH = 0.3
+# crnn_vgg16_bn's default vocab; CTC indices map into this string
+_VOCAB = VOCABS['french']
+
+
+def _resolve_precision(path):
+    """Prefers the INT8-quantized model when OCR_PRECISION=int8 and it exists."""
+    if os.getenv('OCR_PRECISION') == 'int8':
+        int8_path = path.replace('.onnx', '_int8.onnx')
+        if os.path.exists(int8_path):
+            return int8_path
+        logger.warning(f"OCR_PRECISION=int8 but {int8_path} not found; using FP32 model")
+    return path
+
+
+def _make_session(path):
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = os.cpu_count()
+    return ort.InferenceSession(path, sess_options=options, providers=ort.get_available_providers())
+
+
+def _normalize(image, size, mean, std):
+    """Resizes to (h, w), scales to [0, 1], normalizes, and returns NCHW."""
+    resized = cv2.resize(image, (size[1], size[0]), interpolation=cv2.INTER_LINEAR)
+    tensor = (resized.astype(np.float32) / 255.0 - mean) / std
+    return tensor.transpose(2, 0, 1)[None]
+
+
+def _reco_preprocess(crop):
+    """
+    Resizes a crop to recognizer height preserving aspect ratio and
+    right-pads to the target width, matching docTR's preprocessing; wide
+    crops must not be horizontally crushed or the CRNN misreads them.
+    """
+    target_h, target_w = _RECO_SIZE
+    scale = target_h / crop.shape[0]
+    new_w = min(target_w, max(1, int(round(crop.shape[1] * scale))))
+    resized = cv2.resize(crop, (new_w, target_h), interpolation=cv2.INTER_LINEAR)
+    if new_w < target_w:
+        resized = np.pad(resized, ((0, 0), (0, target_w - new_w), (0, 0)))
+    tensor = (resized.astype(np.float32) / 255.0 - _RECO_MEAN) / _RECO_STD
+    return tensor.transpose(2, 0, 1)[None]
+
+
+class OnnxPredictor:
+    """
+    Thin detector+recognizer pipeline over two onnxruntime sessions.
+    Callable on a list of RGB numpy images, like docTR's ocr_predictor.
+    """
+
+    def __init__(self, det_path=DET_ONNX_PATH, reco_path=RECO_ONNX_PATH):
+        self._det = _make_session(_resolve_precision(det_path))
+        self._reco = _make_session(_resolve_precision(reco_path))
+        logger.info(f"ONNX OCR backend ready (providers: {self._det.get_providers()})")
+
+    def __call__(self, images):
+        return SimpleNamespace(pages=[self._process_page(image) for image in images])
+
+    def _process_page(self, image):
+        words = []
+        for box in self._detect(image):
+            x0, y0, x1, y1 = box
+            value = self._recognize(image[y0:y1, x0:x1])
+            if value:
+                words.append((box, value))
+
+        lines = [
+            SimpleNamespace(words=[SimpleNamespace(value=value) for _, value in line])
+            for line in _group_into_lines(words)
+        ]
+        return SimpleNamespace(blocks=[SimpleNamespace(lines=lines)])
+
+    def _detect(self, image):
+        """Runs the DB detector and returns word boxes in image coordinates."""
+        batch = _normalize(image, _DET_SIZE, _DET_MEAN, _DET_STD)
+        logits = self._det.run(None, {self._det.get_inputs()[0].name: batch})[0]
+        prob_map = 1.0 / (1.0 + np.exp(-logits[0, 0]))
+
+        mask = (prob_map > _BIN_THRESH).astype(np.uint8)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        height, width = image.shape[:2]
+        scale_x = width / _DET_SIZE[1]
+        scale_y = height / _DET_SIZE[0]
+        boxes = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if w < 4 or h < 4:
+                continue
+            # Small dilation to recover the shrunken DB text region
+            pad_x, pad_y = int(w * 0.1), int(h * 0.3)
+            x0 = max(0, int((x - pad_x) * scale_x))
+            y0 = max(0, int((y - pad_y) * scale_y))
+            x1 = min(width, int((x + w + pad_x) * scale_x))
+            y1 = min(height, int((y + h + pad_y) * scale_y))
+            if x1 > x0 and y1 > y0:
+                boxes.append((x0, y0, x1, y1))
+        return boxes
+
+    def _recognize(self, crop):
+        """Runs the CRNN recognizer on one crop and CTC-decodes the result."""
+        if crop.size == 0:
+            return ""
+        batch = _reco_preprocess(crop)
+        logits = self._reco.run(None, {self._reco.get_inputs()[0].name: batch})[0]
+        return _ctc_decode(logits[0])
+
+
+def _ctc_decode(logits):
+    """Greedy CTC decode; the blank token is the last class."""
+    blank = logits.shape[-1] - 1
+    best = logits.argmax(axis=-1)
+    chars = []
+    previous = blank
+    for index in best:
+        if index != blank and index != previous:
+            chars.append(_VOCAB[index])
+        previous = index
+    return "".join(chars).strip()
+
+
+def _group_into_lines(words):
+    """
+    Groups (box, value) words into lines by vertical overlap of box centers,
+    then orders each line left-to-right and lines top-to-bottom.
+    """
+    if not words:
+        return []
+
+    words = sorted(words, key=lambda w: (w[0][1] + w[0][3]) / 2)
+    lines = [[words[0]]]
+    for word in words[1:]:
+        box = word[0]
+        center_y = (box[1] + box[3]) / 2
+        last_box = lines[-1][-1][0]
+        if center_y < last_box[3]:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+
+    return [sorted(line, key=lambda w: w[0][0]) for line in lines]
@@ -1,62 +1,267 @@
+import asyncio
+import concurrent.futures
 import logging
-import re
-import requests
+import pickle
 import os
+import time
+import httpx
+import numpy as np
+import torch
+from collections import OrderedDict
 from doctr.io import DocumentFile
+from extract import extract_transaction_info
 from doctr.models import ocr_predictor
+from torchvision.io import ImageReadMode, decode_jpeg
+from torchvision.transforms.v2 import functional as TF
 
 logger = logging.getLogger(__name__)
 
+BANK_NAME = "Telebirr"
 # URL for telebirr receipt verification
 TELEBIRR_VERIFICATION_URL = "https://transactioninfo.ethiotelecom.et/receipt/{}"
 # The string to check for on a successful verification page
 SUCCESS_STRING = "የቴሌብር ክፍያ መረጃ/telebirr Transaction information"
 
-# Initialize the docTR OCR model once when the module is imported
-ocr_model = ocr_predictor(det_arch='db_resnet50', reco_arch='crnn_vgg16_bn', pretrained=True)
+# Shared async client: non-blocking sockets keep the event loop serving other
+# users, and HTTP/2 multiplexes the O/0 retry probes over one TLS connection
+client = httpx.AsyncClient(
+    http2=True,
+    timeout=10.0,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    headers={'Accept-Encoding': 'gzip'},
+)
 
-def extract_transaction_info(text_data):
+# With OCR_BACKEND=onnx the exported onnxruntime models (see
+# export_to_onnx.py) are used instead of the PyTorch predictor; the
+# CUDA/OpenVINO/CPU execution provider is auto-selected by onnxruntime.
+OCR_BACKEND = os.getenv('OCR_BACKEND', 'torch')
+
+# Built lazily on first use: a frontend that delegates OCR to the standalone
+# service (see ocr_service.py) never pays for the model at all.
+ocr_model = None
+
+def _get_model():
+    """Builds the OCR model on first use, honoring OCR_BACKEND/OCR_COMPILE."""
+    global ocr_model
+    if ocr_model is not None:
+        return ocr_model
+
+    if OCR_BACKEND == 'onnx':
+        try:
+            from onnx_ocr import OnnxPredictor
+            ocr_model = OnnxPredictor()
+            return ocr_model
+        except Exception as e:
+            logger.warning(f"Could not initialize ONNX OCR backend, falling back to PyTorch: {e}")
+
+    model = ocr_predictor(det_arch='db_resnet50', reco_arch='crnn_vgg16_bn', pretrained=True)
+
+    # FP16 halves memory traffic on GPU. docTR's predictors read the device
+    # and dtype off the model's own parameters and cast input batches to
+    # match, so moving the predictor is all that is needed.
+    # OCR_PRECISION=int8 is handled by the ONNX backend (see
+    # export_to_onnx.py).
+    if os.getenv('OCR_PRECISION', 'fp32') == 'fp16':
+        if torch.cuda.is_available():
+            model = model.cuda().half()
+        else:
+            logger.warning("OCR_PRECISION=fp16 requested but CUDA is unavailable; running FP32 on CPU")
+
+    # torch.compile fuses the eager per-image graphs. The pre-processors
+    # resize inputs to fixed geometries, but the batch dimension varies with
+    # queue load, so dynamic shapes are left on: after warm-up Inductor
+    # serves every batch size 1.._OCR_MAX_BATCH from a dynamic graph instead
+    # of recompiling per size. OCR_COMPILE=0 opts out.
+    if os.getenv('OCR_COMPILE', '1') == '1':
+        try:
+            model.det_predictor.model = torch.compile(
+                model.det_predictor.model, mode='reduce-overhead')
+            model.reco_predictor.model = torch.compile(
+                model.reco_predictor.model, mode='reduce-overhead')
+        except Exception as e:
+            logger.warning(f"torch.compile unavailable, running eager: {e}")
+
+    ocr_model = model
+    return ocr_model
+
+def _make_dummy_receipt():
+    """
+    Renders a receipt-like image with text lines. A blank image would detect
+    zero words and leave the recognizer cold, so the warm-up would not
+    actually touch its compiled graph or cuDNN kernels.
+    """
+    from PIL import Image, ImageDraw, ImageFont
+    image = Image.new('RGB', (1024, 1024), 'white')
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=40)
+    for y in range(80, 960, 120):
+        draw.text((60, y), "Transaction Number ABC123XYZ0", fill='black', font=font)
+    return np.asarray(image)
+
+def warm_up():
+    """
+    Runs dummy inferences at the batch sizes the bot serves, so lazy CUDA
+    kernel selection, cuDNN autotune, and the torch.compile graphs of both
+    the detector and the recognizer are all paid for at startup instead of
+    on the first user's receipt.
+    """
+    started = time.perf_counter()
+    model = _get_model()
+    dummy = _make_dummy_receipt()
+    for batch_size in (1, _OCR_MAX_BATCH):
+        model([dummy] * batch_size)
+    logger.info(f"OCR warm-up finished in {time.perf_counter() - started:.1f}s")
+
+class LRUCache:
     """
-    Parses the text data to find "Transaction Number" and extracts the value that follows.
+    Small OrderedDict-backed LRU. A tx_id's validity (and an image's OCR
+    result) is immutable, so entries never need invalidation, only eviction.
     """
-    label = "Transaction Number"
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+    
+    def get(self, key, default=None):
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+    
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
     
-    text_data_lower = text_data.lower()
+    def load(self, path: str):
+        try:
+            with open(path, 'rb') as f:
+                self._data.update(pickle.load(f))
+        except (OSError, pickle.PickleError, EOFError) as e:
+            logger.warning(f"Could not load cache from {path}: {e}")
     
-    if label.lower() in text_data_lower:
+    def save(self, path: str):
+        try:
+            with open(path, 'wb') as f:
+                pickle.dump(self._data, f)
+        except (OSError, pickle.PickleError) as e:
+            logger.warning(f"Could not save cache to {path}: {e}")
+
+# tx_id -> verified candidate (or None for definitively invalid receipts)
+_verify_cache = LRUCache(maxsize=4096)
+_CACHE_MISS = object()
+
+class VerificationError(Exception):
+    """
+    Raised when verification could not be completed because probes failed,
+    as opposed to the receipt being definitively invalid.
+    """
+
+# Micro-batching: images from concurrent uploads that arrive within
+# _OCR_MAX_WAIT are coalesced into a single model() forward pass, which
+# amortizes the per-call launch overhead and keeps the GPU busy under load
+_OCR_MAX_BATCH = 8
+_OCR_MAX_WAIT = 0.05
+_ocr_queue = None
+_ocr_worker_task = None
+# The model call releases the GIL inside the C++ kernels, so running it on a
+# worker thread keeps the event loop answering other Telegram users mid-OCR.
+# Two workers let the next batch's preprocessing overlap the current forward
+# pass without oversubscribing the GPU.
+_ocr_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+# On NVIDIA GPUs, nvJPEG decodes the receipt straight into device memory,
+# skipping PIL's CPU decode. The detector resizes to 1024px anyway, so the
+# frame is pre-shrunk on GPU before the (now much smaller) copy back to host
+# that docTR's numpy-based pre-processor requires.
+_GPU_DECODE = torch.cuda.is_available()
+_DET_LONG_SIDE = 1024
+
+def _load_images(image_blobs):
+    """
+    Decodes a batch of in-memory JPEGs into RGB numpy arrays, via nvJPEG when
+    CUDA is available, falling back to docTR's PIL loader otherwise.
+    """
+    if not _GPU_DECODE:
+        return DocumentFile.from_images(image_blobs)
+    try:
+        images = []
+        for blob in image_blobs:
+            raw = torch.frombuffer(bytearray(blob), dtype=torch.uint8)
+            image = decode_jpeg(raw, mode=ImageReadMode.RGB, device='cuda')
+            height, width = image.shape[-2:]
+            scale = _DET_LONG_SIDE / max(height, width)
+            if scale < 1.0:
+                image = TF.resize(image, [int(height * scale), int(width * scale)], antialias=True)
+            images.append(image.permute(1, 2, 0).cpu().numpy())
+        return images
+    except Exception as e:
+        logger.warning(f"GPU JPEG decode failed, falling back to PIL: {e}")
+        return DocumentFile.from_images(image_blobs)
+
+def _run_ocr(image_blobs):
+    """Synchronous OCR forward pass for one batch; runs on _ocr_executor."""
+    model = _get_model()
+    doc = _load_images(image_blobs)
+    return model(doc)
+
+async def _ocr_batch_worker():
+    """
+    Pulls (image_bytes, future) pairs off the queue, batches them, and runs
+    one docTR call per batch, resolving each future with its page.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _ocr_queue.get()]
+        deadline = loop.time() + _OCR_MAX_WAIT
+        while len(batch) < _OCR_MAX_BATCH:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_ocr_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        
         try:
-            start_index = text_data_lower.find(label.lower())
-            end_of_label = start_index + len(label)
-            
-            # Slice the string from the end of the label to the end of the document
-            remainder = text_data[end_of_label:].strip().replace(':', '')
-            
-            if remainder:
-                tx_id = remainder.split()[0].upper()
-                return tx_id
-        except (IndexError, ValueError) as e:
-            logger.warning(f"Error extracting transaction ID: {e}")
-            
-    return None
-
-async def process_image_for_txid(image_path: str):
-    """
-    Processes a single image for a transaction ID using OCR.
+            result = await loop.run_in_executor(
+                _ocr_executor, _run_ocr, [blob for blob, _ in batch])
+            for (_, future), page in zip(batch, result.pages):
+                if not future.done():
+                    future.set_result(page)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+async def _ocr_page(image_bytes: bytes):
+    """
+    Submits one image to the batching queue and waits for its OCR'd page.
+    The worker task is started lazily so it binds to the running loop.
+    """
+    global _ocr_queue, _ocr_worker_task
+    if _ocr_queue is None:
+        _ocr_queue = asyncio.Queue()
+        _ocr_worker_task = asyncio.get_running_loop().create_task(_ocr_batch_worker())
+    
+    future = asyncio.get_running_loop().create_future()
+    await _ocr_queue.put((image_bytes, future))
+    return await future
+
+async def process_image_for_txid(image_bytes: bytes):
+    """
+    Processes a single in-memory image for a transaction ID using OCR.
     """
     try:
-        logger.info(f"Starting docTR OCR on image: {image_path}")
-        doc = DocumentFile.from_images([image_path])
-        result = ocr_model(doc)
+        logger.info(f"Starting docTR OCR on image ({len(image_bytes)} bytes)")
+        page = await _ocr_page(image_bytes)
         
-        if not result or not result.pages:
-            logger.warning("docTR did not return any pages. OCR likely failed.")
-            return None, None
-            
-        full_text = ""
-        for page in result.pages:
-            for block in page.blocks:
-                for line in block.lines:
-                    full_text += " ".join([word.value for word in line.words]) + "\n"
+        full_text = "\n".join(
+            " ".join(word.value for word in line.words)
+            for block in page.blocks
+            for line in block.lines
+        )
         
         if not full_text.strip():
             logger.warning("docTR extracted empty text. OCR likely failed to detect anything.")
@@ -69,37 +274,73 @@ async def process_image_for_txid(image_path: str):
         return tx_id, TELEBIRR_VERIFICATION_URL
         
     except Exception as e:
-        logger.error(f"Error processing image {image_path} with docTR: {e}", exc_info=True)
+        logger.error(f"Error processing image with docTR: {e}", exc_info=True)
         return None, None
 
-def verify_telebirr_receipt(tx_id: str, verify_url: str) -> bool:
+_SUCCESS_NEEDLE = SUCCESS_STRING.encode('utf-8')
+
+async def _probe(url: str) -> bool:
     """
-    Verifies a Telebirr receipt by making an HTTP request.
-    This function includes OCR correction logic.
+    Streams one verification page and returns True as soon as the success
+    marker shows up in the raw bytes, without decoding or buffering the whole
+    body. The sliding window catches the marker across chunk boundaries.
     """
-    full_url = verify_url.format(tx_id)
-    try:
-        response = requests.get(full_url, timeout=10)
-        
-        if response.status_code == 200 and SUCCESS_STRING in response.text:
-            return True
-        
-        # OCR correction logic
-        if 'O' in tx_id:
-            normalized_tx_id = tx_id.replace('O', '0')
-            normalized_url = verify_url.format(normalized_tx_id)
-            normalized_response = requests.get(normalized_url, timeout=10)
-            if normalized_response.status_code == 200 and SUCCESS_STRING in normalized_response.text:
-                return True
-        
-        if '0' in tx_id:
-            normalized_tx_id = tx_id.replace('0', 'O')
-            normalized_url = verify_url.format(normalized_tx_id)
-            normalized_response = requests.get(normalized_url, timeout=10)
-            if normalized_response.status_code == 200 and SUCCESS_STRING in normalized_response.text:
+    async with client.stream('GET', url) as response:
+        if response.status_code != 200:
+            return False
+        window = b''
+        async for chunk in response.aiter_bytes(8192):
+            window = window[-len(_SUCCESS_NEEDLE):] + chunk
+            if _SUCCESS_NEEDLE in window:
                 return True
-        
-        return False
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error during HTTP request: {e}")
-        return False
\ No newline at end of file
+    return False
+
+async def verify(tx_id: str, verify_url: str):
+    """
+    Verifies a Telebirr receipt by probing the original transaction ID and its
+    O/0 OCR-correction candidates concurrently.
+    Returns the transaction ID that verified, or None.
+    """
+    cached = _verify_cache.get(tx_id, _CACHE_MISS)
+    if cached is not _CACHE_MISS:
+        logger.info(f"Verification cache hit for {tx_id}")
+        return cached
+    
+    # A set, so an ID without any O/0 ambiguity costs exactly one probe
+    candidates = {tx_id}
+    if 'O' in tx_id:
+        candidates.add(tx_id.replace('O', '0'))
+    if '0' in tx_id:
+        candidates.add(tx_id.replace('0', 'O'))
+    
+    tasks = {
+        asyncio.create_task(_probe(verify_url.format(candidate))): candidate
+        for candidate in candidates
+    }
+    
+    # Return on the first successful probe and cancel the rest; an invalid
+    # receipt still waits for every probe to answer
+    had_error = False
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                candidate = tasks[task]
+                if task.exception() is not None:
+                    logger.error(f"Error during HTTP request: {task.exception()}")
+                    had_error = True
+                elif task.result():
+                    _verify_cache.put(tx_id, candidate)
+                    return candidate
+    finally:
+        for task in pending:
+            task.cancel()
+    
+    # A failed probe might have been the one candidate that would have
+    # verified, so an error means "could not verify", not "invalid"
+    if had_error:
+        raise VerificationError("verification probes failed")
+    
+    _verify_cache.put(tx_id, None)
+    return None
\ No newline at end of file